@@ -19,7 +19,7 @@ def setup_routes(app: FastAPI, agent):
     @app.post("/query", response_model=QueryResponse)
     async def process_query(query: Query):
         """Process a natural language query about loan data"""
-        response = agent.process_query(query.text)
+        response = await agent.process_query(query.text)
         return response
     
     @app.get("/memory", response_model=MemoryResponse)
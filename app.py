@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from api.endpoints import setup_routes
 from agents.query_agent import QueryAgent
 from db.mock_db import LoanDatabase
@@ -6,7 +7,8 @@ from db.mock_db import LoanDatabase
 app = FastAPI(
     title="Loan Query System",
     description="API for querying loan data using natural language",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Initialize components
@@ -16,6 +18,14 @@ query_agent = QueryAgent(database)
 # Set up API routes
 setup_routes(app, query_agent)
 
+@app.on_event("startup")
+async def preload_model():
+    """Warm the Ollama model at startup to remove first-request cold start"""
+    await query_agent.warm_up()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop and httptools replace the stdlib event loop and HTTP parser
+    # with C implementations, cutting per-request overhead. Workers stay
+    # at 1 because conversation memory lives in-process.
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
\ No newline at end of file
@@ -1,12 +1,60 @@
 import datetime
 import random
+from collections import defaultdict
+import numpy as np
+import orjson
 import pandas as pd
 from typing import Dict, List, Any
 
+# Low-cardinality fields stored as pandas categoricals so filters compare
+# integer codes instead of Python strings.
+_CATEGORICAL_FIELDS = ["region", "sex", "currency", "user_name", "repayment_status"]
+
+def _condition_mask(values: np.ndarray, condition: Any) -> np.ndarray:
+    """Build a boolean mask for one $match condition over a column array"""
+    if not isinstance(condition, dict):
+        return values == condition
+
+    mask = np.ones(len(values), dtype=bool)
+    for op, value in condition.items():
+        # Pipelines express dates as ISO strings; lift them to datetime64
+        # when the column is the datetime mirror.
+        if isinstance(value, str) and np.issubdtype(values.dtype, np.datetime64):
+            value = np.datetime64(value)
+        if op == "$eq":
+            mask &= (values == value)
+        elif op == "$gt":
+            mask &= (values > value)
+        elif op == "$gte":
+            mask &= (values >= value)
+        elif op == "$lt":
+            mask &= (values < value)
+        elif op == "$lte":
+            mask &= (values <= value)
+    return mask
+
 class LoanDatabase:
     def __init__(self):
         self.data = self._generate_mock_data()
-        
+        self._df = pd.DataFrame(self.data)
+        for field in _CATEGORICAL_FIELDS:
+            self._df[field] = self._df[field].astype("category")
+        # Datetime mirror of the ISO date strings so range filters compare
+        # int64 days instead of characters.
+        self._df["disbursed_date_dt"] = pd.to_datetime(self._df["disbursed_date"]).values.astype("datetime64[D]")
+        # Struct-of-arrays view of the frame for mask building without
+        # going through pandas indexing on the hot path.
+        self._cols = {col: self._df[col].to_numpy() for col in self._df.columns}
+        # Inverted indexes: field -> value -> set of record positions, so
+        # find() intersects small sets instead of scanning all records.
+        self._indexes: Dict[str, Dict[Any, set]] = defaultdict(lambda: defaultdict(set))
+        for i, record in enumerate(self.data):
+            for key, value in record.items():
+                self._indexes[key][value].add(i)
+        # The dataset never mutates, so the serialized form can be
+        # computed once instead of per raw-data request.
+        self._raw_json = orjson.dumps(self.data, option=orjson.OPT_INDENT_2).decode()
+
     def _generate_mock_data(self) -> List[Dict[str, Any]]:
         """Generate a mock dataset with 50 loan records"""
         regions = ["North", "Central"]
@@ -88,47 +136,50 @@ class LoanDatabase:
     
     def find(self, filter_dict: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """Find records matching the filter"""
-        if filter_dict is None:
+        if not filter_dict:
             return self.data
-        
-        results = []
-        for record in self.data:
-            match = True
-            for key, value in filter_dict.items():
-                if key not in record or record[key] != value:
-                    match = False
-                    break
-            if match:
-                results.append(record)
-        
-        return results
+
+        # Intersect the per-field inverted index entries, smallest first,
+        # instead of scanning every record against every filter key.
+        index_sets = []
+        for key, value in filter_dict.items():
+            matches = self._indexes.get(key, {}).get(value)
+            if not matches:
+                return []
+            index_sets.append(matches)
+
+        index_sets.sort(key=len)
+        positions = set.intersection(*index_sets)
+        return [self.data[i] for i in sorted(positions)]
     
     def aggregate(self, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Execute MongoDB-style aggregation pipeline"""
-        # Convert to pandas for easier manipulation
-        df = pd.DataFrame(self.data)
-        
-        # For simplicity, we'll implement a subset of MongoDB aggregation
-        result = df
-        
+        return self._run_pipeline(pipeline).to_dict('records')
+
+    def aggregate_json(self, pipeline: List[Dict[str, Any]]) -> str:
+        """Execute an aggregation pipeline, serializing straight to JSON
+
+        Skips the to_dict('records') round-trip through Python dicts and
+        uses pandas' C JSON writer instead.
+        """
+        return self._run_pipeline(pipeline).to_json(orient="records")
+
+    def _run_pipeline(self, pipeline: List[Dict[str, Any]]) -> pd.DataFrame:
+        """Run the pipeline stages and return the resulting DataFrame"""
+        # For simplicity, we'll implement a subset of MongoDB aggregation,
+        # starting from the DataFrame built once at construction.
+        result = self._df
+
         for stage in pipeline:
-            # Match stage
+            # Match stage: combine all conditions into one boolean mask and
+            # slice once, instead of allocating an intermediate DataFrame
+            # per condition.
             if "$match" in stage:
+                mask = np.ones(len(result), dtype=bool)
                 for field, condition in stage["$match"].items():
-                    if isinstance(condition, dict):
-                        for op, value in condition.items():
-                            if op == "$eq":
-                                result = result[result[field] == value]
-                            elif op == "$gt":
-                                result = result[result[field] > value]
-                            elif op == "$gte":
-                                result = result[result[field] >= value]
-                            elif op == "$lt":
-                                result = result[result[field] < value]
-                            elif op == "$lte":
-                                result = result[result[field] <= value]
-                    else:
-                        result = result[result[field] == condition]
+                    values = self._cols[field] if result is self._df else result[field].to_numpy()
+                    mask &= _condition_mask(values, condition)
+                result = result[mask]
             
             # Group stage
             elif "$group" in stage:
@@ -155,7 +206,9 @@ class LoanDatabase:
                         elif op == "$avg":
                             agg_dict[output_field] = ("mean", field_expr)
                 
-                result = result.groupby(group_cols).agg(**agg_dict).reset_index()
+                # observed=True keeps categorical grouping from emitting
+                # empty rows for category combinations filtered out above.
+                result = result.groupby(group_cols, observed=True).agg(**agg_dict).reset_index()
             
             # Project stage
             elif "$project" in stage:
@@ -163,8 +216,12 @@ class LoanDatabase:
                 include_fields = [k for k, v in fields.items() if v == 1]
                 result = result[include_fields]
         
-        return result.to_dict('records')
+        return result
     
     def raw_data(self) -> List[Dict[str, Any]]:
         """Return the entire dataset"""
-        return self.data
\ No newline at end of file
+        return self.data
+
+    def raw_data_json(self) -> str:
+        """Return the entire dataset as its cached JSON serialization"""
+        return self._raw_json
\ No newline at end of file